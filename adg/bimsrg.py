@@ -1,8 +1,5 @@
 """Routines and class for Bogoliubov IMSRG diagrams."""
 
-from future import standard_library
-standard_library.install_aliases()
-from builtins import range
 import math
 import networkx as nx
 import numpy as np
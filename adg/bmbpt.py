@@ -1,11 +1,7 @@
 """Routines and class for Bogoliubov MBPT diagrams."""
 
-from future import standard_library
-standard_library.install_aliases()
-from builtins import str
-from builtins import zip
-from builtins import range
 from adg.tools import reversed_enumerate
+import collections
 import itertools
 import numpy as np
 import networkx as nx
@@ -54,56 +50,106 @@ def diagrams_generation(p_order, three_body_use, nbody_obs, canonical):
     order = p_order + 1
 
     # Create a null oriented adjacency matrix of dimension (p_order,p_order)
-    matrices = [np.zeros((order, order), dtype=int)]
+    # and grow all the candidate matrices at once as a single stacked array,
+    # their vertex degrees being updated along with them
+    stacked_matrices = np.zeros((1, order, order), dtype=np.int8)
+    degrees = np.zeros((1, order), dtype=np.int8)
 
     # Generate oriented adjacency matrices going vertex-wise
-    vertices = list(range(order))
-    add = matrices.append
-    for vertex in vertices:
+    for vertex in range(order):
         if vertex == 0:
             deg_max = 2*nbody_obs
         else:
             deg_max = 6 if three_body_use else 4
         for sum_index in range(vertex+1, order):
-            for mat in reversed(matrices):
-                elem_max = deg_max - sum(mat[k][vertex] + mat[vertex][k]
-                                         for k in vertices)
-                for elem in range(1, elem_max + 1):
-                    temp_mat = mat.copy()
-                    temp_mat[vertex, sum_index] = elem
-                    add(temp_mat)
-        adg.diag.check_vertex_degree(
-            matrices, three_body_use, nbody_obs, canonical, vertex
+            stacked_matrices, degrees = add_propagators(
+                stacked_matrices, degrees, vertex, sum_index, deg_max,
+                6 if three_body_use else 4)
+        # Apply both filters in a single pass over the stacked matrices
+        is_valid = adg.diag.vertex_degree_mask(
+            degrees[:, vertex], three_body_use, nbody_obs, canonical, vertex
         )
         if 0 < vertex < order-1:
-            check_unconnected_spawn(matrices, vertex)
+            is_valid &= unconnected_spawn_mask(stacked_matrices, vertex)
+        stacked_matrices = stacked_matrices[is_valid]
+        degrees = degrees[is_valid]
+    matrices = list(stacked_matrices)
     remove_disconnected_matrices(matrices)
     return order_and_remove_topologically_equiv(matrices, order - 1)
 
 
+def add_propagators(matrices, degrees, vertex, sum_index, deg_max,
+                    sum_index_deg_max):
+    """Return the matrices along with their copies with vertex-to-index props.
+
+    For each matrix, copies are made with 1 up to the maximal number of
+    propagators allowed by the degrees of both vertices going from this vertex
+    to the one in sum_index. Matrices where one of the vertices would exceed
+    its maximal degree are thus never produced.
+
+    Args:
+        matrices (NumPy array): The stacked adjacency matrices being filled.
+        degrees (NumPy array): The degrees of the vertices of each matrix.
+        vertex (int): The vertex the propagators are going out of.
+        sum_index (int): The vertex the propagators are going into.
+        deg_max (int): The maximal degree of the vertex.
+        sum_index_deg_max (int): The maximal degree of the sum_index vertex.
+
+    Returns:
+        (tuple): The input matrices followed by the new ones, and their
+        associated vertex degrees.
+
+    >>> mats = np.array([[[0, 0], [0, 0]], [[0, 1], [0, 0]]])
+    >>> degs = np.array([[0, 0], [1, 1]])
+    >>> new_mats, new_degs = add_propagators(mats, degs, 0, 1, 2, 4)
+    >>> new_mats.tolist() # doctest: +NORMALIZE_WHITESPACE
+    [[[0, 0], [0, 0]], [[0, 1], [0, 0]],
+     [[0, 1], [0, 0]], [[0, 1], [0, 0]], [[0, 2], [0, 0]]]
+    >>> new_degs.tolist()
+    [[0, 0], [1, 1], [2, 2], [1, 1], [2, 2]]
+    >>> new_mats, new_degs = add_propagators(mats, degs, 0, 1, 2, 1)
+    >>> new_mats.tolist() # doctest: +NORMALIZE_WHITESPACE
+    [[[0, 0], [0, 0]], [[0, 1], [0, 0]], [[0, 1], [0, 0]]]
+
+    """
+    # Go through the matrices in reversed order, as done historically
+    nb_new_mats = np.maximum(
+        np.minimum(deg_max - degrees[:, vertex],
+                   sum_index_deg_max - degrees[:, sum_index]), 0)[::-1]
+    new_matrices = np.repeat(matrices[::-1], nb_new_mats, axis=0)
+    new_degrees = np.repeat(degrees[::-1], nb_new_mats, axis=0)
+    # Number the copies of each matrix from 1 to their maximal number
+    offsets = np.repeat(np.cumsum(nb_new_mats) - nb_new_mats, nb_new_mats)
+    nbs_props = np.arange(1, len(new_matrices) + 1) - offsets
+    new_matrices[:, vertex, sum_index] = nbs_props
+    new_degrees[:, vertex] += nbs_props
+    new_degrees[:, sum_index] += nbs_props
+    return (np.concatenate((matrices, new_matrices)),
+            np.concatenate((degrees, new_degrees)))
+
+
 def remove_disconnected_matrices(matrices):
     """Remove matrices corresponding to disconnected diagrams.
 
+    All the matrices are checked at once by propagating the set of vertices
+    linked to the operator vertex through the stacked adjacency matrices.
+
     Args:
         matrices (list): List of adjacency matrices.
 
+    >>> mats = [np.array([[0, 2, 0], [0, 0, 0], [0, 0, 0]]), \
+                np.array([[0, 2, 0], [0, 0, 2], [0, 0, 0]])]
+    >>>
+    >>> remove_disconnected_matrices(mats)
+    >>> mats # doctest: +NORMALIZE_WHITESPACE
+    [array([[0, 2, 0], [0, 0, 2], [0, 0, 0]])]
+
     """
-    vertices = list(range(matrices[0].shape[0]))
-    permutations = [[0] + list(k)
-                    for k in itertools.permutations(vertices[1:])]
-    for idx, matrix in reversed_enumerate(matrices):
-        for reordering in permutations:
-            mat = matrix[:, reordering][reordering, :]
-            for vert in vertices[1:]:
-                # Check if the permuted matrix is block-diagonal
-                if not mat[vertices[:vert], :][:, vertices[vert:]].any() \
-                        and not mat[:, vertices[:vert]
-                                    ][vertices[vert:], :].any():
-                    del matrices[idx]
-                    break
-            else:
-                continue
-            break
+    if not matrices:
+        return
+    is_connected = adg.diag.connectivity_mask(matrices)
+    matrices[:] = [matrix for matrix, keep in zip(matrices, is_connected)
+                   if keep]
 
 
 def order_and_remove_topologically_equiv(matrices, max_vertex):
@@ -118,14 +164,12 @@ def order_and_remove_topologically_equiv(matrices, max_vertex):
 
     """
     matrices_dict = {}
-    for idx, matrix in reversed_enumerate(matrices):
-        row0 = "".join("%i" % elem for elem
-                       in np.sort(matrix[0, :]).tolist())
+    for matrix in reversed(matrices):
+        row0 = tuple(np.sort(matrix[0, :]).tolist())
         if row0 in matrices_dict:
             matrices_dict[row0].append(matrix)
         else:
             matrices_dict[row0] = [matrix]
-        del matrices[idx]
     for row_key in sorted(matrices_dict.keys()):
         matrices_dict[row_key] = \
             check_topologically_equivalent(matrices_dict[row_key], max_vertex)
@@ -161,64 +205,61 @@ def check_topologically_equivalent(matrices, max_vertex):
     if not matrices:
         return []
     vertices = list(range(matrices[0].shape[0]))
-    permutations = [[0] + list(k) + vertices[max_vertex+1:]
-                    for k in itertools.permutations(vertices[1:max_vertex+1])]
-    for ind_mat1, mat1 in reversed_enumerate(matrices[:-1]):
-        mat1_1plus_sorted = np.sort(mat1[1:max_vertex+1, :].flat)
-        for ind_mat2 in range(len(matrices)-1, ind_mat1, -1):
-            mat2 = matrices[ind_mat2]
-            # Basic check to avoid needless permutations
-            if not (mat1_1plus_sorted
-                    - np.sort(mat2[1:max_vertex+1, :].flat)).any():
-                # Test for all possible permutations
-                for reordering in permutations:
-                    if not (mat1 - mat2[:, reordering][reordering, :]).any():
-                        del matrices[ind_mat2]
-                        break
-                else:
-                    continue
-                break
-    return matrices
+    permutations = np.array([[0] + list(k) + vertices[max_vertex+1:]
+                             for k in itertools.permutations(
+                                 vertices[1:max_vertex+1])])
+    # Indices to get all the permuted versions of a matrix at once
+    rows_indices = permutations[:, :, np.newaxis]
+    cols_indices = permutations[:, np.newaxis, :]
+    # Only matrices with identical invariants under the permutations of
+    # the filled vertices need to be tested against one another
+    invariants_dict = {}
+    unique_matrices = []
+    for matrix in matrices:
+        filled_rows = matrix[1:max_vertex+1, :]
+        invariants = (tuple(np.sort(filled_rows.flat).tolist()),
+                      tuple(sorted(zip(
+                          matrix[:, 1:max_vertex+1].sum(axis=0).tolist(),
+                          filled_rows.sum(axis=1).tolist()))))
+        equivalent_candidates = invariants_dict.setdefault(invariants, [])
+        if equivalent_candidates:
+            permuted_matrices = matrix[rows_indices, cols_indices]
+            if any((permuted_matrices == candidate).all(axis=(1, 2)).any()
+                   for candidate in equivalent_candidates):
+                continue
+        equivalent_candidates.append(matrix)
+        unique_matrices.append(matrix)
+    return unique_matrices
 
 
-def check_unconnected_spawn(matrices, max_filled_vertex):
-    """Exclude some matrices that would spawn unconnected diagrams.
+def unconnected_spawn_mask(matrices, max_filled_vertex):
+    """Return which stacked matrices can still spawn connected diagrams.
 
-    Do several permutations among the rows and columns corresponding to already
-    filled vertices, and check if one obtains a block-diagonal organisation,
-    where the off-diagonals blocks connecting the already-filled and
-    yet-unfilled parts of the matrix would be empty. In that case, remove the
-    matrix.
+    Check if the matrices have a block-diagonal organisation, where the
+    off-diagonals blocks connecting the already-filled and yet-unfilled parts
+    of the matrix would be empty. In that case, the matrix is to be removed.
+    Permuting the already-filled vertices among themselves leaves those blocks
+    empty or not, such that all the matrices can be checked at once as they
+    are.
 
     Args:
-        matrices (list): The adjacency matrices to be checked.
+        matrices (NumPy array): The stacked adjacency matrices to be checked.
         max_filled_vertex (int): The furthest vertex until which the matrices
             have been filled.
 
-    >>> import numpy
-    >>> mats = [numpy.array([[0, 2, 0], [2, 0, 0], [0, 0, 0]]), \
-                numpy.array([[0, 2, 1], [2, 0, 1], [0, 0, 0]])]
-    >>>
-    >>> check_unconnected_spawn(mats, 1)
-    >>> mats # doctest: +NORMALIZE_WHITESPACE
-    [array([[0, 2, 1], [2, 0, 1], [0, 0, 0]])]
+    Returns:
+        (NumPy array): ``True`` for the matrices to be kept.
+
+    >>> mats = np.array([[[0, 2, 0], [2, 0, 0], [0, 0, 0]],
+    ...                  [[0, 2, 1], [2, 0, 1], [0, 0, 0]]])
+    >>> unconnected_spawn_mask(mats, 1)
+    array([False,  True])
 
     """
-    vertices = list(range(matrices[0].shape[0]))
-    permutations = [[0] + list(k) + vertices[max_filled_vertex+1:]
-                    for k
-                    in itertools.permutations(vertices[1:max_filled_vertex+1])]
-    for ind_mat, matrix in reversed_enumerate(matrices):
-        # Test for all possible permutations
-        for reordering in permutations:
-            mat = matrix[:, reordering][reordering, :]
-            # Check for non-zero elements in off-diagonal blocks
-            if not mat[:, vertices[:max_filled_vertex+1]
-                       ][vertices[max_filled_vertex+1:], :].any() \
-                    and not mat[vertices[:max_filled_vertex+1],
-                                :][:, vertices[max_filled_vertex+1:]].any():
-                del matrices[ind_mat]
-                break
+    nb_filled = max_filled_vertex + 1
+    # Check for non-zero elements in off-diagonal blocks
+    return matrices[:, :nb_filled, nb_filled:].any(axis=(1, 2)) \
+        | matrices[:, nb_filled:, :nb_filled].any(axis=(1, 2))
 
 
 def write_header(tex_file, commands, diags_nbs):
@@ -383,12 +424,12 @@ class BmbptFeynmanDiagram(adg.diag.Diagram):
         self.feynman_exp = ""
         self.diag_exp = ""
         self.vert_exp = []
-        if 2 not in self.degrees:
-            self.hf_type = "HF"
-        elif 2 not in self.unsort_degrees[1:]:
+        if 2 in self.unsort_degrees[1:]:
+            self.hf_type = "noHF"
+        elif self.unsort_degrees[0] == 2:
             self.hf_type = "EHF"
         else:
-            self.hf_type = "noHF"
+            self.hf_type = "HF"
         self.unique_id = tag_num
         self._vert_exchange_sym_fact = None
 
@@ -613,19 +654,15 @@ class BmbptFeynmanDiagram(adg.diag.Diagram):
                          if not self.graph.nodes[vertex]['operator']
                          and self.unsort_io_degrees.count(degrees) >= 2]
         permutations = []
-        op_nm = nx.algorithms.isomorphism.categorical_node_match('operator',
-                                                                 False)
         for permutation in itertools.permutations(perm_vertices):
             permuted_graph = nx.relabel_nodes(self.graph,
                                               dict(list(zip(perm_vertices,
                                                             permutation))),
                                               copy=True)
-            # Check for a permutation that leaves the graph unchanged
-            # (only way to keep the edge list of the same length)
-            # (is_isomorphic could maybe be replaced by something faster here)
-            if nx.is_isomorphic(self.graph,
-                                nx.intersection(self.graph, permuted_graph),
-                                node_match=op_nm):
+            # Check for a permutation that leaves the graph unchanged, i.e.
+            # whose intersection with the graph keeps all of its edges
+            if all(permuted_graph.has_edge(*edge)
+                   for edge in self.graph.edges(keys=True)):
                 permutations.append(dict(list(zip(perm_vertices,
                                                   permutation))))
         return permutations
@@ -697,12 +734,12 @@ class BmbptFeynmanDiagram(adg.diag.Diagram):
 
         """
         nb_crossings = 0
-        for vertex in self.graph:
-            for propagator in self.graph.out_edges(vertex, keys=True):
-                for vertex_ante in range(propagator[0]):
-                    for vertex_post in range(propagator[0]+1, propagator[1]):
-                        nb_crossings += self.graph.number_of_edges(vertex_ante,
-                                                                   vertex_post)
+        props_counts = collections.Counter(self.graph.edges())
+        for (start, end), nb_props in props_counts.items():
+            for vertex_ante in range(start):
+                for vertex_post in range(start + 1, end):
+                    nb_crossings += nb_props \
+                        * props_counts[(vertex_ante, vertex_post)]
         return nb_crossings % 2 == 1
 
     def multiplicity_symmetry_factor(self):
@@ -714,12 +751,10 @@ class BmbptFeynmanDiagram(adg.diag.Diagram):
         """
         factor = ""
         # Account for up to three-body operators
-        prop_multiplicity = [0 for _ in range(6)]
-        for vertex_i in self.graph:
-            for vertex_j in self.graph:
-                if self.graph.number_of_edges(vertex_i, vertex_j) >= 2:
-                    prop_multiplicity[self.graph.number_of_edges(
-                        vertex_i, vertex_j) - 1] += 1
+        prop_multiplicity = [0] * 6
+        for nb_props in collections.Counter(self.graph.edges()).values():
+            if nb_props >= 2:
+                prop_multiplicity[nb_props - 1] += 1
 
         for prop_id, multiplicity in enumerate(prop_multiplicity):
             if multiplicity == 1:
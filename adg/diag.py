@@ -1,14 +1,48 @@
 """Routines and class for all types of diagrams, inherited by others."""
 
-from builtins import range
-from builtins import object, str
 from adg.tools import reversed_enumerate
 
-import copy
+import shutil
 import numpy
 import networkx as nx
 
 
+LINE_STYLES = {
+    'prop_pm': "\\fmfcmd{style_def prop_pm expr p =\n"
+               + "draw_plain p;\nshrink(.7);\n"
+               + "\tcfill (marrow (p, .25));\n"
+               + "\tcfill (marrow (p, .75))\n"
+               + "endshrink;\nenddef;}\n",
+    'prop_mm': "\\fmfcmd{style_def prop_mm expr p =\n"
+               + "draw_plain p;\nshrink(.7);\n"
+               + "\tcfill (marrow (p, .75));\n"
+               + "\tcfill (marrow (reverse p, .75))\n"
+               + "endshrink;\nenddef;}\n",
+    'half_prop': "\\fmfcmd{style_def half_prop expr p =\n"
+                 + "draw_plain p;\nshrink(.7);\n"
+                 + "\tcfill (marrow (p, .5))\n"
+                 + "endshrink;\nenddef;}\n"
+}
+
+THEORY_PROPAGATORS = {"MBPT": "half_prop", "BMBPT": "prop_pm",
+                      "PBMBPT": "prop_pm", "BIMSRG": "half_prop"}
+
+PROP_DIRECTIONS = (",right=0.9", ",right=0.75", ",right=0.6", ",right=0.5",
+                   "", ",left=0.5", ",left=0.6", ",left=0.75", ",left=0.9")
+
+MANY_PROP_DIRECTIONS = tuple(",right=0.%i" % angle
+                             for angle in range(90, 0, -10)) \
+    + tuple(",left=0.%i" % angle for angle in range(10, 100, 10))
+
+VERTEX_INSTRUCTIONS = "\\fmf{phantom}{v%i,v%i}\n" \
+    + "\\fmfv{d.shape=%s,d.filled=full,d.size=3thick}{v%i}\n"
+
+SELF_CONTRACTION_INSTRUCTIONS = "\\fmfv{}{%(a_name)s}\n" \
+    + "\\fmffixed{(%(position)s,0)}{v%(vertex)i,%(a_name)s}\n" \
+    + "\\fmf{half_prop,right}{%(a_name)s,v%(vertex)i}\n" \
+    + "\\fmf{half_prop,left}{%(a_name)s,v%(vertex)i}\n"
+
+
 def no_trace(matrices):
     """Select matrices with full 0 diagonal.
 
@@ -23,56 +57,119 @@ def no_trace(matrices):
     [[0, 1, 3], [2, 0, 8], [2, 1, 0]]]
     >>> no_trace(test_matrices)
     [[[0, 1, 2], [2, 0, 1], [5, 2, 0]], [[0, 1, 3], [2, 0, 8], [2, 1, 0]]]
+    >>> no_trace([])
+    []
 
     """
-    traceless_matrices = []
-    for matrix in matrices:
-        for ind_i, line in enumerate(matrix):
-            if line[ind_i] != 0:
-                break
-        else:
-            traceless_matrices.append(matrix)
-    return traceless_matrices
+    if len(matrices) == 0:
+        return []
+    return [matrix for matrix, is_traceless
+            in zip(matrices, traceless_mask(matrices)) if is_traceless]
+
 
+def traceless_mask(matrices):
+    """Return which stacked adjacency matrices have a full 0 diagonal.
 
-def check_vertex_degree(matrices, three_body_use, nbody_max_observable,
-                        canonical_only, vertex_id):
-    """Check the degree of a specific vertex in a set of matrices.
+    Args:
+        matrices (list): The adjacency matrices to be checked.
+
+    Returns:
+        (NumPy array): ``True`` for the matrices without self-loops.
+
+    >>> mats = numpy.eye(3, dtype=numpy.int8)[[[0, 1, 2], [1, 2, 0]]]
+    >>> traceless_mask(mats)
+    array([False,  True])
+
+    """
+    return ~numpy.asarray(matrices).diagonal(axis1=1, axis2=2).any(axis=1)
+
+
+def vertex_degree_mask(vertex_degrees, three_body_use, nbody_max_observable,
+                       canonical_only, vertex_id):
+    """Return which degrees of a specific vertex are authorized.
 
     Args:
-        matrices (list): Adjacency matrices.
+        vertex_degrees (NumPy array): The degree of the vertex in each matrix.
         three_body_use (bool): ``True`` if one uses three-body forces.
         nbody_max_observable (int): Maximum body number for the observable.
         canonical_only (bool): ``True`` if one draws only canonical diagrams.
         vertex_id (int): The position of the studied vertex.
 
-    >>> test_matrices = [numpy.array([[0, 1, 2], [1, 0, 1], [0, 2, 0]]), \
-        numpy.array([[2, 0, 2], [1, 2, 3], [1, 0, 0]]), \
-        numpy.array([[0, 1, 3], [2, 0, 8], [2, 1, 0]])]
-    >>> check_vertex_degree(test_matrices, True, 3, False, 0)
-    >>> test_matrices #doctest: +NORMALIZE_WHITESPACE
-    [array([[0, 1, 2], [1, 0, 1], [0, 2, 0]]),
-     array([[2, 0, 2], [1, 2, 3], [1, 0, 0]])]
-    >>> check_vertex_degree(test_matrices, False, 2, False, 0)
-    >>> test_matrices #doctest: +NORMALIZE_WHITESPACE
-    [array([[0, 1, 2], [1, 0, 1], [0, 2, 0]])]
+    Returns:
+        (NumPy array): ``True`` for the matrices to be kept.
+
+    >>> vertex_degree_mask(numpy.array([4, 6, 8]), True, 3, False, 0)
+    array([ True,  True, False])
+    >>> vertex_degree_mask(numpy.array([4, 6, 8]), False, 2, False, 0)
+    array([ True, False, False])
+    >>> vertex_degree_mask(numpy.array([2, 4, 6]), False, 2, True, 1)
+    array([False,  True, False])
+    >>> vertex_degree_mask(numpy.array([2, 4, 6]), True, 2, False, 1)
+    array([ True,  True,  True])
 
     """
+    if vertex_id == 0:
+        return vertex_degrees <= 2*nbody_max_observable
     authorized_deg = [4]
     if three_body_use:
         authorized_deg.append(6)
-    if not canonical_only or vertex_id == 0:
+    if not canonical_only:
         authorized_deg.append(2)
-    authorized_deg = tuple(authorized_deg)
+    return numpy.isin(vertex_degrees, authorized_deg)
+
+
+def connectivity_mask(matrices):
+    """Return which stacked adjacency matrices describe connected diagrams.
+
+    The set of vertices linked to the first vertex is propagated through all
+    the matrices at once, regardless of the propagators orientation.
+
+    Args:
+        matrices (list): The adjacency matrices to be checked.
+
+    Returns:
+        (NumPy array): ``True`` for the matrices of connected diagrams.
+
+    >>> mats = numpy.array([[[0, 2, 0], [0, 0, 0], [0, 0, 0]],
+    ...                     [[0, 2, 0], [0, 0, 0], [0, 2, 0]]])
+    >>> connectivity_mask(mats)
+    array([False,  True])
+
+    """
+    matrices = numpy.asarray(matrices)
+    links = (matrices + matrices.transpose(0, 2, 1)) != 0
+    is_reached = numpy.zeros(matrices.shape[:2], dtype=bool)
+    is_reached[:, 0] = True
+    for _ in range(matrices.shape[1] - 1):
+        is_reached |= (is_reached[:, :, numpy.newaxis] & links).any(axis=1)
+    return is_reached.all(axis=1)
+
+
+def graph_from_matrix(matrix):
+    """Return the NetworkX graph associated to an adjacency matrix.
+
+    Each non-zero element of the matrix is turned into as many parallel edges
+    of unit weight, all added to the graph in a single call.
+
+    Args:
+        matrix (NumPy array): The adjacency matrix of the diagram.
+
+    Returns:
+        (NetworkX MultiDiGraph): The graph associated to the matrix.
 
-    for i_mat, matrix in reversed_enumerate(matrices):
-        vertex_degree = sum(matrix[index][vertex_id] + matrix[vertex_id][index]
-                            for index in list(range(matrix.shape[0])))
-        vertex_degree -= matrix[vertex_id][vertex_id]
+    >>> graph = graph_from_matrix(numpy.array([[0, 2], [1, 0]]))
+    >>> list(graph.edges(data=True)) # doctest: +NORMALIZE_WHITESPACE
+    [(0, 1, {'weight': 1}), (0, 1, {'weight': 1}), (1, 0, {'weight': 1})]
 
-        if (vertex_id != 0 and vertex_degree not in authorized_deg) \
-                or (vertex_id == 0 and vertex_degree > 2*nbody_max_observable):
-            del matrices[i_mat]
+    """
+    graph = nx.MultiDiGraph()
+    graph.add_nodes_from(range(len(matrix)))
+    starts, ends = numpy.nonzero(matrix)
+    multiplicities = numpy.asarray(matrix)[starts, ends]
+    graph.add_edges_from(zip(numpy.repeat(starts, multiplicities).tolist(),
+                             numpy.repeat(ends, multiplicities).tolist()),
+                         weight=1)
+    return graph
 
 
 def topologically_distinct_diagrams(diagrams):
@@ -89,17 +186,30 @@ def topologically_distinct_diagrams(diagrams):
     iso = nx.algorithms.isomorphism
     op_nm = iso.categorical_node_match('operator', False)
     anom_em = iso.categorical_multiedge_match('anomalous', False)
-    for i_diag, diag in reversed_enumerate(diagrams):
-        graph = diag.graph
-        diag_io_degrees = diag.io_degrees
-        for i_comp_diag, comp_diag in reversed_enumerate(diagrams[:i_diag]):
-            if diag_io_degrees == comp_diag.io_degrees:
+    # Only diagrams with identical degrees and signatures can be
+    # topologically equivalent
+    buckets = {}
+    for diag in diagrams:
+        if isinstance(diag, adg.pbmbpt.ProjectedBmbptDiagram):
+            signature = diag.check_signature
+        else:
+            signature = graph_signature(diag.graph)
+        buckets.setdefault((diag.io_degrees, signature), []).append(diag)
+    # Diagrams merged into a topologically equivalent one
+    merged_diagrams = set()
+    for bucket in buckets.values():
+        for i_diag, diag in reversed_enumerate(bucket):
+            if id(diag) in merged_diagrams:
+                continue
+            is_pbmbpt = isinstance(diag, adg.pbmbpt.ProjectedBmbptDiagram)
+            graph = diag.graph
+            for comp_diag in reversed(bucket[:i_diag]):
+                if id(comp_diag) in merged_diagrams:
+                    continue
                 # Check anomalous character of props for PBMBPT
-                if isinstance(diag, adg.pbmbpt.ProjectedBmbptDiagram):
-                    doubled_graph = create_checkable_diagram(graph)
-                    doubled_comp_diag = create_checkable_diagram(comp_diag.graph)
-                    matcher = iso.DiGraphMatcher(doubled_graph,
-                                                 doubled_comp_diag,
+                if is_pbmbpt:
+                    matcher = iso.DiGraphMatcher(diag.check_graph,
+                                                 comp_diag.check_graph,
                                                  node_match=op_nm,
                                                  edge_match=anom_em)
                 # Check for topologically equivalent diags considering vertex
@@ -117,8 +227,10 @@ def topologically_distinct_diagrams(diagrams):
                                                 matcher.mapping)
                             )
                     diag.tags += comp_diag.tags
-                    del diagrams[i_comp_diag]
-                    break
+                    merged_diagrams.add(id(comp_diag))
+    # Keep the remaining diagrams in their original order
+    diagrams[:] = [diag for diag in diagrams
+                   if id(diag) not in merged_diagrams]
     return diagrams
 
 
@@ -131,12 +243,14 @@ def update_permutations(comp_graph_perms, comp_graph_tag, mapping):
         mapping (dict): permutations to go from previous ref TSD to new one.
 
     """
-    identity = {key: key for key in comp_graph_perms[comp_graph_tag]}
+    tag_perms = comp_graph_perms[comp_graph_tag]
     # Do permutations only when necessary
-    if mapping != identity:
+    if len(mapping) != len(tag_perms) \
+            or any(key not in mapping or mapping[key] != key
+                   for key in tag_perms):
         for graph_id in comp_graph_perms:
             # Create a dummy dictionary to avoid overwriting some nodes
-            dummy_nodes = copy.deepcopy(comp_graph_perms[graph_id])
+            dummy_nodes = dict(comp_graph_perms[graph_id])
             # Permute the nodes according to the new mapping
             for node in comp_graph_perms[graph_id]:
                 comp_graph_perms[graph_id][node] = dummy_nodes[mapping[node]]
@@ -147,6 +261,9 @@ def update_permutations(comp_graph_perms, comp_graph_tag, mapping):
 def create_checkable_diagram(pbmbpt_graph):
     """Return a graph with anomalous props going both ways for topo check.
 
+    The graph itself is returned when it has no anomalous props to double, as
+    the checkable graph is only meant to be read.
+
     Args:
         pbmbpt_graph (NetworkX MultiDiGraph): The graph to be copied.
 
@@ -154,14 +271,59 @@ def create_checkable_diagram(pbmbpt_graph):
         (NetworkX MultiDiGraph): Graph with double the anomalous props.
 
     """
-    doubled_graph = copy.deepcopy(pbmbpt_graph)
     props_to_add = [(prop[1], prop[0]) for prop
-                    in doubled_graph.edges(keys=True, data='anomalous')
+                    in pbmbpt_graph.edges(keys=True, data='anomalous')
                     if prop[3] and not prop[0] == prop[1]]
+    if not props_to_add:
+        return pbmbpt_graph
+    doubled_graph = pbmbpt_graph.copy()
     doubled_graph.add_edges_from(props_to_add, anomalous=True, weight=1)
     return doubled_graph
 
 
+def graph_signature(graph, edge_attr=None):
+    """Return a signature of the graph invariant under vertex relabelling.
+
+    Each vertex is characterised by its operator character and its in- and
+    out-degrees, refined once with the characteristics of its neighbours and
+    the value of the given edge attribute. Isomorphic graphs thus share the
+    same signature, so that graphs with different signatures do not need to
+    be checked for isomorphism.
+
+    Args:
+        graph (NetworkX MultiDiGraph): The graph of interest.
+        edge_attr (str): The name of the edge attribute to be accounted for.
+
+    Returns:
+        (tuple): The signature of the graph.
+
+    >>> graph = nx.MultiDiGraph([(0, 1), (0, 1), (1, 2)])
+    >>> relabelled_graph = nx.relabel_nodes(graph, {0: 2, 2: 0})
+    >>> other_graph = nx.MultiDiGraph([(0, 1), (1, 2), (1, 2)])
+    >>> graph_signature(graph) == graph_signature(relabelled_graph)
+    True
+    >>> graph_signature(graph) == graph_signature(other_graph)
+    False
+
+    """
+    operators = dict(graph.nodes(data='operator', default=False))
+    in_degrees = dict(graph.in_degree())
+    out_degrees = dict(graph.out_degree())
+    colours = dict((node, (operators[node], in_degrees[node],
+                           out_degrees[node]))
+                   for node in graph)
+    predecessors = dict((node, []) for node in graph)
+    successors = dict((node, []) for node in graph)
+    for start, end, attributes in graph.edges(data=True):
+        attribute = attributes.get(edge_attr, False)
+        successors[start].append((colours[end], attribute))
+        predecessors[end].append((colours[start], attribute))
+    return tuple(sorted((colours[node],
+                         tuple(sorted(predecessors[node])),
+                         tuple(sorted(successors[node])))
+                        for node in graph))
+
+
 def label_vertices(graphs_list, theory_type, switch_flag):
     """Account for different status of vertices in operator diagrams.
 
@@ -170,6 +332,18 @@ def label_vertices(graphs_list, theory_type, switch_flag):
         theory_type (str): The name of the theory of interest.
         switch_flag (int): When to switch A and B operators for BIMSRG.
 
+    >>> graphs = [nx.MultiDiGraph(), nx.MultiDiGraph()]
+    >>> for graph in graphs: graph.add_nodes_from(range(3))
+    >>> label_vertices(graphs, "MBPT", 0)
+    >>> [graphs[0].nodes[node]['operator'] for node in graphs[0]]
+    [False, False, False]
+    >>> label_vertices(graphs, "PBMBPT", 0)
+    >>> [graphs[0].nodes[node]['operator'] for node in graphs[0]]
+    [True, False, False]
+    >>> label_vertices(graphs, "BIMSRG", 1)
+    >>> [graph.nodes[1]['operator'] for graph in graphs]
+    ['B', 'A']
+
     """
     if theory_type != 'BIMSRG':
         for graph in graphs_list:
@@ -187,77 +361,75 @@ def label_vertices(graphs_list, theory_type, switch_flag):
                 graph.nodes[2]['operator'] = 'B'
 
 
-def feynmf_generator(graph, theory_type, diagram_name):
+def feynmf_generator(graph, theory_type, diagram_name, directory="."):
     """Generate the feynmanmp instructions corresponding to the diagram.
 
     Args:
         graph (NetworkX MultiDiGraph): The graph of interest.
         theory_type (str): The name of the theory of interest.
         diagram_name (str): The name of the studied diagram.
+        directory (str): Path to the folder the file is written in.
 
     """
     p_order = graph.number_of_nodes()
     diag_size = 20*p_order
 
-    theories = ["MBPT", "BMBPT", "PBMBPT", "BIMSRG"]
-    prop_types = ["half_prop", "prop_pm", "prop_pm", "half_prop"]
-    propa = prop_types[theories.index(theory_type)]
+    propa = THEORY_PROPAGATORS[theory_type]
 
-    fmf_file = open(diagram_name + ".tex", 'w')
-    fmf_file.write("\\parbox{40pt}{\\begin{fmffile}{%s}\n" % diagram_name
-                   + "\\begin{fmfgraph*}(40,%i)\n" % diag_size)
+    instructions = [f"\\parbox{{40pt}}{{\\begin{{fmffile}}{{{diagram_name}}}\n"
+                    f"\\begin{{fmfgraph*}}(40,{diag_size})\n"]
 
     # Define the appropriate line propagator_style
-    fmf_file.write(propagator_style(propa))
+    instructions.append(propagator_style(propa))
     if theory_type == "PBMBPT":
-        fmf_file.write(propagator_style("prop_mm"))
+        instructions.append(propagator_style("prop_mm"))
 
     # Set the position of the vertices
     if theory_type == "BIMSRG":
-        bimsrg_diagram_internals(graph, fmf_file, propa)
+        instructions.append(bimsrg_diagram_internals(graph, propa))
 
     else:
-        fmf_file.write(vertex_positions(graph, p_order))
+        instructions.append(vertex_positions(graph, p_order))
 
         # Special config for self-contraction
         if theory_type == "PBMBPT":
-            fmf_file.write(self_contractions(graph))
-
-        # Loop over all elements of the graph to draw associated propagators
-        for vert_i in graph:
-            for vert_j in list(graph.nodes())[vert_i+1:]:
-                props_to_draw = [edge for edge in graph.edges([vert_i, vert_j],
-                                                              data=True,
-                                                              keys=True)
-                                 if edge[1] in (vert_i, vert_j)
-                                 and edge[0] != edge[1]]
-                # Set the list of propagators directions to use
-                props_dir = prop_directions(vert_j - vert_i, len(props_to_draw))
-                # Draw the diagrams
-                key = 0
-                # Start with props going down, used in MBPT only
-                for _ in (p for p in props_to_draw
-                          if p[1] < p[0]
-                          and not ('anomalous' in p[3] and p[3]['anomalous'])):
-                    fmf_file.write("\\fmf{%s%s}{v%i,v%i}\n"
-                                   % (propa, props_dir[key], vert_j, vert_i))
-                    key += 1
-                # Reinitialise the drawing configuration as we change direction
-                key = 0
-                for _ in (p for p in props_to_draw
-                          if ('anomalous' in p[3] and p[3]['anomalous'])):
-                    fmf_file.write("\\fmf{prop_mm%s}{v%i,v%i}\n"
-                                   % (props_dir[key], vert_i, vert_j))
-                    key += 1
-                for _ in (p for p in props_to_draw
-                          if p[0] < p[1]
-                          and not ('anomalous' in p[3] and p[3]['anomalous'])):
-                    fmf_file.write("\\fmf{%s%s}{v%i,v%i}\n"
-                                   % (propa, props_dir[key], vert_i, vert_j))
-                    key += 1
-
-    fmf_file.write("\\end{fmfgraph*}\n\\end{fmffile}}\n")
-    fmf_file.close()
+            instructions.append(self_contractions(graph))
+
+        # Count the propagators going down, anomalous and going up between
+        # each pair of vertices in a single pass over the edges
+        props_counts = {}
+        for start, end, anomalous in graph.edges(data='anomalous'):
+            if start != end:
+                counts = props_counts.setdefault(
+                    (min(start, end), max(start, end)), [0, 0, 0])
+                if anomalous:
+                    counts[1] += 1
+                elif end < start:
+                    counts[0] += 1
+                else:
+                    counts[2] += 1
+        # Loop over all pairs of vertices to draw associated propagators
+        for (vert_i, vert_j), (nb_down, nb_anom, nb_up) \
+                in sorted(props_counts.items()):
+            # Set the list of propagators directions to use
+            props_dir = prop_directions(vert_j - vert_i,
+                                        nb_down + nb_anom + nb_up)
+            # Draw the diagrams, starting with props going down, used in
+            # MBPT only
+            for key in range(nb_down):
+                instructions.append(f"\\fmf{{{propa}{props_dir[key]}}}"
+                                    f"{{v{vert_j},v{vert_i}}}\n")
+            # Reinitialise the drawing configuration as we change direction
+            for key in range(nb_anom):
+                instructions.append(f"\\fmf{{prop_mm{props_dir[key]}}}"
+                                    f"{{v{vert_i},v{vert_j}}}\n")
+            for key in range(nb_anom, nb_anom + nb_up):
+                instructions.append(f"\\fmf{{{propa}{props_dir[key]}}}"
+                                    f"{{v{vert_i},v{vert_j}}}\n")
+
+    instructions.append("\\end{fmfgraph*}\n\\end{fmffile}}\n")
+    with open(f"{directory}/{diagram_name}.tex", 'w') as fmf_file:
+        fmf_file.write("".join(instructions))
 
 
 def prop_directions(vert_distance, nb_props):
@@ -272,13 +444,11 @@ def prop_directions(vert_distance, nb_props):
 
     """
     if nb_props < 7:
-        directions = [",right=0.9", ",right=0.75", ",right=0.6", ",right=0.5",
-                      "", ",left=0.5", ",left=0.6", ",left=0.75", ",left=0.9"]
-
         if vert_distance != 1:
-            props_dir = directions[:3] + directions[-3:]
+            props_dir = PROP_DIRECTIONS[:3] + PROP_DIRECTIONS[-3:]
         else:
-            props_dir = directions[:2] + directions[3:6] + directions[-2:]
+            props_dir = PROP_DIRECTIONS[:2] + PROP_DIRECTIONS[3:6] \
+                + PROP_DIRECTIONS[-2:]
             if nb_props % 2 != 1:
                 props_dir = props_dir[:3] + props_dir[-3:]
             else:
@@ -289,12 +459,9 @@ def prop_directions(vert_distance, nb_props):
                 props_dir = props_dir[1:-1]
 
     elif vert_distance == 1:
-        directions = [",right=0.%i" % angle for angle in range(90, 0, -10)] \
-            + [",left=0.%i" % angle for angle in range(10, 100, 10)]
+        props_dir = MANY_PROP_DIRECTIONS[nb_props//4:-(nb_props//4)]
 
-        props_dir = directions[nb_props//4:-(nb_props//4)]
-
-    return props_dir
+    return list(props_dir)
 
 
 def propagator_style(prop_type):
@@ -307,26 +474,7 @@ def propagator_style(prop_type):
         (str): The FeynMF definition for the propagator style used.
 
     """
-    line_styles = {}
-
-    line_styles['prop_pm'] = "\\fmfcmd{style_def prop_pm expr p =\n" \
-        + "draw_plain p;\nshrink(.7);\n" \
-        + "\tcfill (marrow (p, .25));\n" \
-        + "\tcfill (marrow (p, .75))\n" \
-        + "endshrink;\nenddef;}\n"
-
-    line_styles['prop_mm'] = "\\fmfcmd{style_def prop_mm expr p =\n" \
-        + "draw_plain p;\nshrink(.7);\n" \
-        + "\tcfill (marrow (p, .75));\n" \
-        + "\tcfill (marrow (reverse p, .75))\n" \
-        + "endshrink;\nenddef;}\n"
-
-    line_styles['half_prop'] = "\\fmfcmd{style_def half_prop expr p =\n" \
-        + "draw_plain p;\nshrink(.7);\n" \
-        + "\tcfill (marrow (p, .5))\n" \
-        + "endshrink;\nenddef;}\n"
-
-    return line_styles[prop_type]
+    return LINE_STYLES[prop_type]
 
 
 def vertex_positions(graph, order):
@@ -340,16 +488,14 @@ def vertex_positions(graph, order):
         (str): The FeynMP instructions for positioning the vertices.
 
     """
-    positions = "\\fmftop{v%i}\\fmfbottom{v0}\n" % (order-1)
+    positions = [f"\\fmftop{{v{order - 1}}}\\fmfbottom{{v0}}\n"]
+    operators = dict(graph.nodes(data='operator'))
     for vert in range(order-1):
-        positions += "\\fmf{phantom}{v%i,v%i}\n" % (vert, (vert+1)) \
-            + ("\\fmfv{d.shape=square,d.filled=full,d.size=3thick"
-               if 'operator' in graph.nodes[vert] and graph.nodes[vert]['operator']
-               else "\\fmfv{d.shape=circle,d.filled=full,d.size=3thick") \
-            + "}{v%i}\n" % vert
-    positions += "\\fmfv{d.shape=circle,d.filled=full,d.size=3thick}{v%i}\n" \
-        % (order-1) + "\\fmffreeze\n"
-    return positions
+        shape = "square" if operators[vert] else "circle"
+        positions.append(VERTEX_INSTRUCTIONS % (vert, vert+1, shape, vert))
+    positions.append("\\fmfv{d.shape=circle,d.filled=full,d.size=3thick}"
+                     f"{{v{order - 1}}}\n\\fmffreeze\n")
+    return "".join(positions)
 
 
 def self_contractions(graph):
@@ -362,105 +508,97 @@ def self_contractions(graph):
         (str): FeynMF instructions for drawing the self-contractions.
 
     """
-    instructions = ""
+    instructions = []
     # Check for self-contractions before going further
     if [nx.selfloop_edges(graph)]:
-        instructions += propagator_style("half_prop")
+        instructions.append(propagator_style("half_prop"))
+        self_loops = list(nx.selfloop_edges(graph, data=True, keys=True))
+        positions = ["15pt", "-15pt"]
         for vert in graph:
-            props_to_draw = [edge for edge
-                             in nx.selfloop_edges(graph, data=True, keys=True)
-                             if edge[0] == vert]
-            positions = ["15pt", "-15pt"]
             key = 0
-            for prop in props_to_draw:
-                if prop[3]['anomalous']:
-                    a_name = "a%i%i" % (vert, key)
-                    instructions += ("\\fmfv{}{%s}\n" % a_name
-                                     + "\\fmffixed{(%s,0)}{v%i,%s}\n"
-                                     % (positions[key], vert, a_name)
-                                     + "\\fmf{half_prop,right}{%s,v%i}\n"
-                                     % (a_name, vert)
-                                     + "\\fmf{half_prop,left}{%s,v%i}\n"
-                                     % (a_name, vert))
+            for prop in self_loops:
+                if prop[0] == vert and prop[3]['anomalous']:
+                    instructions.append(SELF_CONTRACTION_INSTRUCTIONS % {
+                        'a_name': f"a{vert}{key}",
+                        'position': positions[key],
+                        'vertex': vert})
                     key += 1
-        instructions += "\\fmffreeze\n"
-    return instructions
+        instructions.append("\\fmffreeze\n")
+    return "".join(instructions)
 
 
-def bimsrg_diagram_internals(graph, fmf_file, prop_type):
-    """Write to file the vertices and propagators of BIMSRG diagrams.
+def bimsrg_diagram_internals(graph, prop_type):
+    """Return the vertices and propagators instructions of BIMSRG diagrams.
 
     Args:
         graph (NetworkX MultiDiGraph): The graph to be drawn.
-        fmf_file (file): The FeymanMF file to be written to.
         prop_type (str): The FeymanMF type for drawing the propagators.
 
+    Returns:
+        (str): The FeynMF instructions for drawing the diagram internals.
+
     """
-    nbs_out_edges = (sum(1 for p in graph.in_edges(3, keys=True) if p[0] == 1),
-                     sum(1 for p in graph.in_edges(3, keys=True) if p[0] == 2))
-    nbs_in_edges = (sum(1 for p in graph.out_edges(0, keys=True) if p[1] == 1),
-                    sum(1 for p in graph.out_edges(0, keys=True) if p[1] == 2))
+    nbs_out_edges = (graph.number_of_edges(1, 3), graph.number_of_edges(2, 3))
+    nbs_in_edges = (graph.number_of_edges(0, 1), graph.number_of_edges(0, 2))
 
-    nb_out_edges = len(graph.in_edges(3, keys=True))
-    nb_in_edges = len(graph.out_edges(0, keys=True))
+    nb_out_edges = graph.in_degree(3)
+    nb_in_edges = graph.out_degree(0)
 
     nb_top_vertices = nb_out_edges if nb_out_edges == 1 \
         else (max(2*nbs_out_edges[0], 2*nbs_out_edges[1]) + 1)
     nb_bot_vertices = nb_in_edges if nb_in_edges == 1 \
         else (max(2*nbs_in_edges[0], 2*nbs_in_edges[1]) + 1)
 
-    positions = "\\fmfstraight\n" \
-        + "\\fmftopn{t}{%i}" % nb_top_vertices \
-        + "\\fmfbottomn{b}{%i}\n" % nb_bot_vertices \
-        + "\\fmf{phantom}{b%i,v1}\n" % (nb_bot_vertices//2 + 1) \
-        + "\\fmf{phantom}{v1,v2}\n" \
-        + "\\fmf{phantom}{v2,t%i}\n" % (nb_top_vertices//2 + 1) \
-        + "\\fmfv{d.shape=circle,d.filled=%s,d.size=3thick}{v1}\n" \
-        % ('full' if graph.nodes[1]['operator'] == 'A' else 'empty') \
-        + "\\fmfv{d.shape=circle,d.filled=%s,d.size=3thick}{v2}\n" \
-        % ('full' if graph.nodes[2]['operator'] == 'A' else 'empty') \
-        + "\\fmffreeze\n"
-    fmf_file.write(positions)
+    fillings = ['full' if graph.nodes[vertex]['operator'] == 'A'
+                else 'empty' for vertex in (1, 2)]
+    instructions = [
+        "\\fmfstraight\n"
+        f"\\fmftopn{{t}}{{{nb_top_vertices}}}"
+        f"\\fmfbottomn{{b}}{{{nb_bot_vertices}}}\n"
+        f"\\fmf{{phantom}}{{b{nb_bot_vertices//2 + 1},v1}}\n"
+        "\\fmf{phantom}{v1,v2}\n"
+        f"\\fmf{{phantom}}{{v2,t{nb_top_vertices//2 + 1}}}\n"
+        f"\\fmfv{{d.shape=circle,d.filled={fillings[0]},d.size=3thick}}"
+        "{v1}\n"
+        f"\\fmfv{{d.shape=circle,d.filled={fillings[1]},d.size=3thick}}"
+        "{v2}\n"
+        "\\fmffreeze\n"
+    ]
 
     # Internal lines
-    nb_props = sum(1 for edge in graph.edges(1, keys=True) if edge[1] == 2)
+    nb_props = graph.number_of_edges(1, 2)
     # Set the list of propagators directions to use
     props_dir = prop_directions(1, nb_props)
     # Draw the propagators
     for idx in range(nb_props):
-        fmf_file.write("\\fmf{%s%s}{v1,v2}\n" % (prop_type, props_dir[idx]))
+        instructions.append(f"\\fmf{{{prop_type}{props_dir[idx]}}}{{v1,v2}}\n")
 
     # Incoming external line
     for vertex in (1, 2):
-        nb_props = sum(1 for edge in graph.edges(0, keys=True)
-                       if edge[1] == vertex)
+        nb_props = graph.number_of_edges(0, vertex)
         if (nb_bot_vertices == 1) and (vertex == 1):
             orientation = ""
         else:
             orientation = ",left=0.4" if vertex == 2 else ",right=0.3"
         # Draw the propagators
         for key in range(nb_props):
-            fmf_file.write("\\fmf{%s%s}{b%i,v%i}\n"
-                           % (prop_type,
-                              orientation,
-                              key+1 if vertex == 2 else nb_bot_vertices - key,
-                              vertex))
+            bot_vertex = key+1 if vertex == 2 else nb_bot_vertices - key
+            instructions.append(f"\\fmf{{{prop_type}{orientation}}}"
+                                f"{{b{bot_vertex},v{vertex}}}\n")
 
     # Outgoing external lines
     for vertex in (1, 2):
-        nb_props = sum(1 for edge in graph.in_edges(3, keys=True)
-                       if edge[0] == vertex)
+        nb_props = graph.number_of_edges(vertex, 3)
         if (nb_top_vertices == 1) and (vertex == 2):
             orientation = ""
         else:
             orientation = ",right=0.4" if vertex == 1 else ",left=0.3"
         # Draw the propagators
         for key in range(nb_props):
-            fmf_file.write("\\fmf{%s%s}{v%i,t%i}\n"
-                           % (prop_type,
-                              orientation,
-                              vertex,
-                              key+1 if vertex == 2 else nb_top_vertices - key))
+            top_vertex = key+1 if vertex == 2 else nb_top_vertices - key
+            instructions.append(f"\\fmf{{{prop_type}{orientation}}}"
+                                f"{{v{vertex},t{top_vertex}}}\n")
+    return "".join(instructions)
 
 
 def draw_diagram(directory, result_file, diagram_index, diag_type):
@@ -473,9 +611,9 @@ def draw_diagram(directory, result_file, diagram_index, diag_type):
         diag_type (str): The type of diagram used here.
 
     """
-    with open(directory+"/Diagrams/%s_%s.tex"
-              % (diag_type, diagram_index)) as diag_file:
-        result_file.write(diag_file.read())
+    with open(f"{directory}/Diagrams/{diag_type}_{diagram_index}.tex") \
+            as diag_file:
+        shutil.copyfileobj(diag_file, result_file)
 
 
 def to_skeleton(graph):
@@ -492,8 +630,12 @@ def to_skeleton(graph):
         for vertex_b in graph:
             while graph.number_of_edges(vertex_a, vertex_b) > 1:
                 graph.remove_edge(vertex_a, vertex_b)
-            if len(list(nx.all_simple_paths(graph, vertex_a, vertex_b))) > 1:
-                while len(nx.shortest_path(graph, vertex_a, vertex_b)) == 2:
+            if vertex_a != vertex_b and graph.has_edge(vertex_a, vertex_b):
+                # The link is redundant if another path joins the vertices
+                edge_key = next(iter(graph[vertex_a][vertex_b]))
+                other_paths_graph = nx.restricted_view(
+                    graph, [], [(vertex_a, vertex_b, edge_key)])
+                if nx.has_path(other_paths_graph, vertex_a, vertex_b):
                     graph.remove_edge(vertex_a, vertex_b)
     return graph
 
@@ -510,40 +652,26 @@ def extract_denom(start_graph, subgraph):
         (str): The denominator factor for this subgraph.
 
     """
-    denomin = r"\epsilon^{" \
-        + "".join("%s"
-                  % prop[3]['qp_state']
-                  for prop
-                  in start_graph.out_edges(subgraph, keys=True, data=True)
-                  if not subgraph.has_edge(prop[0], prop[1], prop[2])
-                  and not ('anomalous' in prop[3] and prop[3]['anomalous'])) \
-        + "}_{" \
-        + "".join("%s"
-                  % prop[3]['qp_state']
-                  for prop
-                  in start_graph.in_edges(subgraph, keys=True, data=True)
-                  if not subgraph.has_edge(prop[0], prop[1], prop[2])
-                  and not ('anomalous' in prop[3] and prop[3]['anomalous'])) \
-        + "".join("%s"
-                  % prop[3]['qp_state']
-                  for prop
-                  in start_graph.in_edges(subgraph, keys=True, data=True)
-                  if subgraph.has_edge(prop[0], prop[1], prop[2])
-                  and ('anomalous' in prop[3] and prop[3]['anomalous'])) \
-        + "".join("%s"
-                  % (prop[3]['qp_state'].split("}")[0] + "}")
-                  for prop
-                  in start_graph.in_edges(subgraph, keys=True, data=True)
-                  if not subgraph.has_edge(prop[0], prop[1], prop[2])
-                  and ('anomalous' in prop[3] and prop[3]['anomalous'])) \
-        + "".join("%s"
-                  % (prop[3]['qp_state'].split("}")[1] + "}")
-                  for prop
-                  in start_graph.out_edges(subgraph, keys=True, data=True)
-                  if not subgraph.has_edge(prop[0], prop[1], prop[2])
-                  and ('anomalous' in prop[3] and prop[3]['anomalous'])) \
-        + "}"
-    return denomin
+    out_props, out_anom_props = [], []
+    for prop in start_graph.out_edges(subgraph, keys=True, data=True):
+        if not subgraph.has_edge(prop[0], prop[1], prop[2]):
+            if prop[3].get('anomalous'):
+                out_anom_props.append(prop[3]['qp_state'].split("}")[1] + "}")
+            else:
+                out_props.append(prop[3]['qp_state'])
+    in_props, in_anom_props, in_anom_ext_props = [], [], []
+    for prop in start_graph.in_edges(subgraph, keys=True, data=True):
+        is_internal = subgraph.has_edge(prop[0], prop[1], prop[2])
+        if not prop[3].get('anomalous'):
+            if not is_internal:
+                in_props.append(prop[3]['qp_state'])
+        elif is_internal:
+            in_anom_props.append(prop[3]['qp_state'])
+        else:
+            in_anom_ext_props.append(prop[3]['qp_state'].split("}")[0] + "}")
+    return r"\epsilon^{" + "".join(out_props) + "}_{" \
+        + "".join(in_props + in_anom_props + in_anom_ext_props
+                  + out_anom_props) + "}"
 
 
 def print_adj_matrices(directory, diagrams):
@@ -554,21 +682,28 @@ def print_adj_matrices(directory, diagrams):
         diagrams (list): All the diagrams.
 
     """
+    matrices = []
+    for idx, diagram in enumerate(diagrams):
+        matrix = nx.to_numpy_array(diagram.graph, dtype=int).tolist()
+        matrices.append("Diagram n: %i\n" % (idx + 1)
+                        + "".join("%s\n" % " ".join("%d" % elem
+                                                     for elem in line)
+                                  for line in matrix)
+                        + "\n")
     with open(directory+"/adjacency_matrices.txt", "w") as mat_file:
-        for idx, diagram in enumerate(diagrams):
-            mat_file.write("Diagram n: %i\n" % (idx + 1))
-            numpy.savetxt(mat_file,
-                          nx.to_numpy_matrix(diagram.graph, dtype=int),
-                          fmt='%d')
-            mat_file.write("\n")
+        mat_file.write("".join(matrices))
 
 
-class Diagram(object):
+class Diagram:
     """Describes a diagram with its related properties.
 
+    Instances only store the attributes declared in ``__slots__``. Subclasses
+    must declare their own additional attributes the same way, or their
+    instances would get back a per-instance ``__dict__``.
+
     Attributes:
         graph (NetworkX MultiDiGraph): The actual graph.
-        unsorted_degrees (tuple): The degrees of the graph vertices
+        unsort_degrees (tuple): The degrees of the graph vertices
         degrees (tuple): The ascendingly sorted degrees of the graph vertices.
         unsort_io_degrees (tuple): The list of in- and out-degrees for each
             vertex of the graph, stored in a (in, out) tuple.
@@ -589,12 +724,14 @@ class Diagram(object):
 
         """
         self.graph = nx_graph
-        self.unsort_degrees = tuple(nx_graph.degree(node) for node in nx_graph)
-        self.degrees = tuple(sorted(self.unsort_degrees))
-        self.unsort_io_degrees = tuple((nx_graph.in_degree(node),
-                                        nx_graph.out_degree(node))
+        in_degrees = dict(nx_graph.in_degree())
+        out_degrees = dict(nx_graph.out_degree())
+        self.unsort_io_degrees = tuple((in_degrees[node], out_degrees[node])
                                        for node in nx_graph)
         self.io_degrees = tuple(sorted(self.unsort_io_degrees))
+        self.unsort_degrees = tuple(in_degree + out_degree for in_degree,
+                                    out_degree in self.unsort_io_degrees)
+        self.degrees = tuple(sorted(self.unsort_degrees))
         self.max_degree = self.degrees[-1]
         self.tags = [0]
 
@@ -1,11 +1,9 @@
 """Main routine of the Automated Diagram Generator."""
-from __future__ import print_function
 
 from datetime import datetime
 import sys
 import adg.run
 import adg.bmbpt
-import adg.bimsrg
 import adg.mbpt
 import adg.tools
 import adg.tsd
@@ -1,11 +1,6 @@
 """Routines and class for Many-Body Perturbation Theory diagrams."""
-from __future__ import print_function
-from __future__ import division
 
-from builtins import map
-from builtins import range
 from adg.tools import reversed_enumerate
-import copy
 import itertools
 import string
 import numpy as np
@@ -13,6 +8,12 @@ import networkx as nx
 import adg.diag
 
 
+# Hole and particle labels for the propagators of low- and high-order diagrams
+LOW_ORDER_QP_LABELS = (string.ascii_lowercase[:8], string.ascii_lowercase[8:])
+HIGH_ORDER_QP_LABELS = (string.ascii_lowercase[:13],
+                        string.ascii_lowercase[13:])
+
+
 def diagrams_generation(order):
     """Generate the diagrams for the MBPT case.
 
@@ -33,27 +34,20 @@ def diagrams_generation(order):
 
     """
     # Generate all 1-magic square of dimension order
-    seeds = [k for k in itertools.permutations(list(range(order)), order)]
-    all_matrices = [[[0 if i != j else 1 for i in range(order)]
-                     for j in k]
-                    for k in seeds]
-    traceless = adg.diag.no_trace(all_matrices)
-    coeffs = [i for i in itertools.combinations_with_replacement(
-        list(range(len(traceless))), 2)]
-    double = []
-
-    for coef in coeffs:
-        matrix = copy.deepcopy(traceless[coef[0]])
-        for i, line in enumerate(traceless[coef[1]]):
-            for j, elem in enumerate(line):
-                matrix[i][j] += elem
-        double.append(matrix)
-    double_uniq = []
-    for matrix in double:
-        if matrix not in double_uniq:
-            double_uniq.append(matrix)
-    double_uniq.sort(reverse=True)
-    return [np.array(matrix) for matrix in double_uniq]
+    permutations = np.array(list(itertools.permutations(range(order))))
+    all_matrices = np.eye(order, dtype=np.int8)[permutations]
+    traceless = all_matrices[adg.diag.traceless_mask(all_matrices)]
+    # Sum all pairs of traceless matrices at once
+    first_indices, second_indices = np.triu_indices(len(traceless))
+    double = traceless[first_indices] + traceless[second_indices]
+    # Sort and remove duplicates using each matrix as a single byte string,
+    # equivalent to a lexicographic order as all elements are non-negative
+    double = np.ascontiguousarray(double.reshape(len(double), order*order))
+    _, uniq_indices = np.unique(
+        double.view(np.dtype((np.void, order*order))).ravel(),
+        return_index=True)
+    return [matrix.reshape(order, order).astype(int)
+            for matrix in double[uniq_indices[::-1]]]
 
 
 def write_diag_exp(latex_file, mbpt_diag):
@@ -95,17 +89,16 @@ def print_cd_output(directory, diagrams):
         diagrams (list): All the MbptDiagrams.
 
     """
-    cd_file = open(directory + '/CD_output.txt', 'w')
-    conjug_file = open(directory + '/CD_conjug_pairs.list', 'w')
-    for diag in diagrams:
-        cd_file.write('config[%i] = %s\n' % (diag.tags[0] + 1, diag.cd_expr))
-        if (diag.complex_conjugate != -1) \
-                and (diag.complex_conjugate > diag.tags[0]):
-            conjug_file.write("%i\t%i\n" % (diag.tags[0] + 1,
-                                            diag.complex_conjugate + 1))
-    cd_file.write('\n')
-    cd_file.close()
-    conjug_file.close()
+    cd_lines = ['config[%i] = %s\n' % (diag.tags[0] + 1, diag.cd_expr)
+                for diag in diagrams]
+    conjug_lines = ["%i\t%i\n" % (diag.tags[0] + 1, diag.complex_conjugate + 1)
+                    for diag in diagrams
+                    if (diag.complex_conjugate != -1)
+                    and (diag.complex_conjugate > diag.tags[0])]
+    with open(directory + '/CD_output.txt', 'w') as cd_file:
+        cd_file.write("".join(cd_lines) + '\n')
+    with open(directory + '/CD_conjug_pairs.list', 'w') as conjug_file:
+        conjug_file.write("".join(conjug_lines))
 
 
 def order_diagrams(diagrams):
@@ -260,8 +253,8 @@ class MbptDiagram(adg.diag.Diagram):
         sign = "-" if (self.count_hole_lines()
                        - self.loops_number()) % 2 == 1 else ""
         eq_lines = np.array(self.incidence.transpose())
-        neq_lines = np.asarray(list(i for i in set(map(tuple, eq_lines))))
-        nedges_eq = 2**(len(eq_lines)-len(neq_lines))
+        nb_neq_lines = np.unique(eq_lines, axis=0).shape[0]
+        nedges_eq = 2**(len(eq_lines) - nb_neq_lines)
 
         self.expr = sign \
             + ("\\dfrac{1}{%i}" % nedges_eq if nedges_eq != 1 else "") \
@@ -278,14 +271,12 @@ class MbptDiagram(adg.diag.Diagram):
             (int): The singles / doubles / etc. character of the graph.
 
         """
-        max_excited_states = 0
-        for row in range(1, self.graph.number_of_nodes()):
-            nb_excited_states = sum(1 for col
-                                    in range(self.graph.number_of_edges())
-                                    if self.incidence[0:row, col].sum() == 1)
-            if nb_excited_states > max_excited_states \
-                    and nb_excited_states != 2:
-                max_excited_states = nb_excited_states
+        # Lines going out of the first vertices, for all rows at once
+        partial_sums = np.asarray(self.incidence).cumsum(axis=0)[:-1]
+        nbs_excited_states = (partial_sums == 1).sum(axis=1).tolist()
+        max_excited_states = max([0] + [nb_excited_states for nb_excited_states
+                                        in nbs_excited_states
+                                        if nb_excited_states != 2])
         return max_excited_states if max_excited_states != 0 else 2
 
     def count_hole_lines(self):
@@ -313,15 +304,13 @@ class MbptDiagram(adg.diag.Diagram):
 
     def attribute_ph_labels(self):
         """Attribute the appropriate qp labels to the graph's propagators."""
-        labels = list(string.ascii_lowercase)
         # Labelling needs to be shifted for higher orders
-        if len(self.graph) < 6:
-            h_labels, p_labels = labels[0:8], labels[8:]
-        else:
-            h_labels, p_labels = labels[0:13], labels[13:]
+        h_labels, p_labels = (iter(labels) for labels
+                              in (LOW_ORDER_QP_LABELS if len(self.graph) < 6
+                                  else HIGH_ORDER_QP_LABELS))
         for prop in self.graph.edges(keys=True, data=True):
-            prop[3]['qp_state'] = h_labels.pop(0) if prop[0] < prop[1] \
-                else p_labels.pop(0)
+            prop[3]['qp_state'] = next(h_labels) if prop[0] < prop[1] \
+                else next(p_labels)
 
     def extract_denominator(self):
         """Return the denominator for a MBPT graph.
@@ -1,15 +1,10 @@
 """Routines and class for Projected Bogoliubov MBPT diagrams."""
-from __future__ import division
 
-from builtins import str
-from builtins import range
-from past.utils import old_div
 from operator import xor
-import copy
+import collections
 import itertools
 import networkx as nx
 import adg.bmbpt
-import adg.tsd
 import adg.diag
 
 
@@ -39,7 +34,7 @@ def generate_anomalous_diags(diag, nbody_max):
 
     for comb in unique_edge_combinations(tweakable_edges,
                                          diag.equivalent_permutations()):
-        new_graph = copy.deepcopy(graph)
+        new_graph = graph.copy()
         for edge in comb:
             key = sum(1 for prop
                       in new_graph.out_edges(edge[0], keys=True, data=True)
@@ -53,11 +48,11 @@ def generate_anomalous_diags(diag, nbody_max):
         for v in vertices:
             test_vertices += [v for _
                               in range(nbody_max
-                                       - (old_div(iter_graph.degree(v), 2)))]
+                                       - (iter_graph.degree(v) // 2))]
         if test_vertices:
             for comb in unique_vertex_combinations(
                     test_vertices, equiv_generating_permutations(iter_graph)):
-                new_graph = copy.deepcopy(iter_graph)
+                new_graph = iter_graph.copy()
                 new_graph.add_edges_from(((vert, vert) for vert in comb),
                                          anomalous=True)
                 anom_graphs.append(new_graph)
@@ -105,7 +100,7 @@ def unique_edge_combinations(edges, permutations):
     if len(permutations) <= 1:
         return edge_combs
 
-    unique_edge_combs = copy.deepcopy(edge_combs)
+    unique_edge_combs = list(edge_combs)
     for idx, comb1 in enumerate(edge_combs):
         for comb2 in edge_combs[idx+1:]:
             is_same_perm = False
@@ -149,7 +144,7 @@ def unique_vertex_combinations(vertices, permutations):
     combinations = generate_combinations(vertices)
     if len(combinations) <= 1:
         return combinations
-    unique_combs = copy.deepcopy(combinations)
+    unique_combs = list(combinations)
     for idx, comb1 in enumerate(combinations):
         for comb2 in combinations[idx+1:]:
             is_same_perm = False
@@ -178,9 +173,6 @@ def equiv_generating_permutations(graph):
         (list): The mappings giving equivalent graphs, inc. identity.
 
     """
-    op_nm = nx.algorithms.isomorphism.categorical_node_match('operator', False)
-    anom_em = nx.algorithms.isomorphism.categorical_multiedge_match('anomalous',
-                                                                    False)
     unsort_io_degrees = []
     for node in graph:
         # Edges going out that are anomalous are annihilators going in
@@ -205,14 +197,10 @@ def equiv_generating_permutations(graph):
                                           dict(list(zip(perm_vertices,
                                                         permutation))),
                                           copy=True)
-        intersection = copy.deepcopy(doubled_graph)
-        intersection.remove_edges_from(e for e in doubled_graph.edges()
-                                       if e not in permuted_graph.edges())
-        matcher = nx.algorithms.isomorphism.DiGraphMatcher(doubled_graph,
-                                                           intersection,
-                                                           node_match=op_nm,
-                                                           edge_match=anom_em)
-        if matcher.is_isomorphic():
+        # The permutation leaves the graph unchanged if none of its edges
+        # would be removed by intersecting it with the permuted graph
+        permuted_edges = permuted_graph.edges()
+        if all(edge in permuted_edges for edge in doubled_graph.edges()):
             permutations.append(dict(list(zip(perm_vertices, permutation))))
     return permutations
 
@@ -222,7 +210,8 @@ def filter_new_diagrams(new_diags, old_diags):
 
     Attibutes:
         new_diags (list): The list of newly created PBMBPT diagrams.
-        old_diags (list): The list of already checked PBMBPT diagrams.
+        old_diags (list): The PBMBPT diagrams already kept from previous
+            spawns, without their parent BMBPT diagrams.
 
     """
     iso = nx.algorithms.isomorphism
@@ -234,7 +223,9 @@ def filter_new_diagrams(new_diags, old_diags):
         if new_diag.has_anom_non_selfcontracted_props():
             for new_diag_2 in new_diags[:ind]:
                 if new_diag_2.io_degrees == new_diag.io_degrees \
-                        and new_diag_2.has_anom_non_selfcontracted_props():
+                        and new_diag_2.has_anom_non_selfcontracted_props() \
+                        and new_diag_2.check_signature \
+                        == new_diag.check_signature:
                     matcher = iso.DiGraphMatcher(new_diag.check_graph,
                                                  new_diag_2.check_graph,
                                                  node_match=op_nm,
@@ -243,13 +234,11 @@ def filter_new_diagrams(new_diags, old_diags):
                         del new_diags[ind]
                         break
             else:
-                # Go through the list backwards: first items are BMBPT diags
                 for old_diag in reversed(old_diags):
-                    if not isinstance(old_diag, ProjectedBmbptDiagram):
-                        # All PBMBPT diags have been parsed
-                        break
                     if old_diag.io_degrees == new_diag.io_degrees \
-                            and old_diag.has_anom_non_selfcontracted_props():
+                            and old_diag.has_anom_non_selfcontracted_props() \
+                            and old_diag.check_signature \
+                            == new_diag.check_signature:
                         matcher = iso.DiGraphMatcher(old_diag.check_graph,
                                                      new_diag.check_graph,
                                                      node_match=op_nm,
@@ -277,12 +266,15 @@ class ProjectedBmbptDiagram(adg.bmbpt.BmbptFeynmanDiagram):
         vertex_exchange_sym_factor (int): Lazy-initialized symmetry factor
             associated to the vertex exchange, stored to avoid being computed
             several times.
-        check_graph (NetworkX MultiDiGraph): A copy of the graph that can be
-            used for topological equivalence checks (lazy-initialized).
+        check_graph (NetworkX MultiDiGraph): A read-only version of the graph
+            that can be used for topological equivalence checks
+            (lazy-initialized).
+        check_signature (tuple): The signature of the check graph, used to
+            skip unnecessary topological equivalence checks (lazy-initialized).
 
     """
 
-    __slots__ = ('_check_graph',)
+    __slots__ = ('_check_graph', '_check_signature')
 
     def __init__(self, graph, unique_id, tag, child_tag):
         """Generate a PBMBPT diagram by copying a BMBPT one.
@@ -314,6 +306,7 @@ class ProjectedBmbptDiagram(adg.bmbpt.BmbptFeynmanDiagram):
         self.unsort_io_degrees = tuple(unsort_io_degrees)
         self.io_degrees = tuple(sorted(self.unsort_io_degrees))
         self._check_graph = None
+        self._check_signature = None
 
     def extract_integral(self):
         """Return the integral part of the Feynman expression of the diag.
@@ -485,23 +478,14 @@ class ProjectedBmbptDiagram(adg.bmbpt.BmbptFeynmanDiagram):
         """
         factor = ""
         # Account for up to three-body operators
-        prop_multiplicity = [0 for _ in range(6)]
-        for vertex_i in self.graph:
-            for vertex_j in self.graph:
-                nb_normal_props = sum(1 for prop
-                                      in self.graph.edges(vertex_i,
-                                                          keys=True,
-                                                          data='anomalous')
-                                      if prop[1] == vertex_j and not prop[3])
-                nb_anomalous_props = sum(1 for prop
-                                         in self.graph.edges(vertex_i,
-                                                             keys=True,
-                                                             data='anomalous')
-                                         if prop[1] == vertex_j and prop[3])
-                if nb_anomalous_props >= 2:
-                    prop_multiplicity[nb_anomalous_props - 1] += 1
-                if nb_normal_props >= 2:
-                    prop_multiplicity[nb_normal_props - 1] += 1
+        prop_multiplicity = [0] * 6
+        # Normal and anomalous props between two vertices are counted apart
+        props_counts = collections.Counter(
+            (prop[0], prop[1], bool(prop[2]))
+            for prop in self.graph.edges(data='anomalous'))
+        for nb_props in props_counts.values():
+            if nb_props >= 2:
+                prop_multiplicity[nb_props - 1] += 1
 
         for prop_id, multiplicity in enumerate(prop_multiplicity):
             if multiplicity == 1:
@@ -527,11 +511,6 @@ class ProjectedBmbptDiagram(adg.bmbpt.BmbptFeynmanDiagram):
             (list): Vertices permutations as dictionnaries.
 
         """
-        op_nm = nx.algorithms.isomorphism.categorical_node_match('operator',
-                                                                 False)
-        anom_em = nx.algorithms.isomorphism.categorical_multiedge_match(
-            'anomalous', False)
-
         perm_vertices = [vertex for vertex, degrees
                          in enumerate(self.unsort_io_degrees)
                          if not self.graph.nodes[vertex]['operator']
@@ -542,16 +521,12 @@ class ProjectedBmbptDiagram(adg.bmbpt.BmbptFeynmanDiagram):
                                               dict(list(zip(perm_vertices,
                                                             perm))),
                                               copy=True)
-            # Check for a permutation that leaves the graph unchanged
-            # (only way to keep the edge list of the same length)
-            intersection = copy.deepcopy(self.check_graph)
-            intersection.remove_edges_from(e for e in self.check_graph.edges()
-                                           if e not in permuted_graph.edges())
-            check = nx.algorithms.isomorphism.DiGraphMatcher(self.check_graph,
-                                                             intersection,
-                                                             node_match=op_nm,
-                                                             edge_match=anom_em)
-            if check.is_isomorphic():
+            # Check for a permutation that leaves the graph unchanged, i.e.
+            # none of its edges would be removed by intersecting it with the
+            # permuted graph
+            permuted_edges = permuted_graph.edges()
+            if all(edge in permuted_edges
+                   for edge in self.check_graph.edges()):
                 permutations.append(dict(list(zip(perm_vertices, perm))))
         return permutations
 
@@ -616,7 +591,7 @@ class ProjectedBmbptDiagram(adg.bmbpt.BmbptFeynmanDiagram):
         """Return a graph that can be used for topological equivalence checks.
 
         Lazy-initialized to reduce memory and CPU costs as this operation
-        requires a deep copy.
+        may require a copy of the graph.
 
         Returns:
             (NetworkX MultiDiGraph): The graph with doubled anomalous props.
@@ -626,6 +601,22 @@ class ProjectedBmbptDiagram(adg.bmbpt.BmbptFeynmanDiagram):
             self._check_graph = adg.diag.create_checkable_diagram(self.graph)
         return self._check_graph
 
+    @property
+    def check_signature(self):
+        """Return the signature of the graph used for topological checks.
+
+        Lazy-initialized as it is only needed for diagrams having anomalous
+        propagators that are not self-contractions.
+
+        Returns:
+            (tuple): The signature of the check graph.
+
+        """
+        if self._check_signature is None:
+            self._check_signature = adg.diag.graph_signature(self.check_graph,
+                                                             'anomalous')
+        return self._check_signature
+
     def write_graph(self, latex_file, directory, write_time):
         """Write the PBMBPT graph and its associated TSD to the LaTeX file.
 
@@ -1,18 +1,14 @@
 """Routines handling the run of ADG."""
-from __future__ import print_function
 
-from future import standard_library
-standard_library.install_aliases()
-from builtins import input
-from builtins import range
 from adg.tools import reversed_enumerate
 import os
 import argparse
 import shutil
-import networkx as nx
+import subprocess
 import adg.mbpt
 import adg.bmbpt
 import adg.pbmbpt
+import adg.bimsrg
 import adg.diag
 
 
@@ -298,13 +294,12 @@ def generate_diagrams(commands, id_generator):
         exit()
     print("Number of matrices produced: ", len(diagrams))
 
-    diags = [nx.from_numpy_array(diagram, create_using=nx.MultiDiGraph(),
-                                 parallel_edges=True) for diagram in diagrams]
+    if commands.theory == "MBPT" and diagrams:
+        is_connected = adg.diag.connectivity_mask(diagrams)
+        diagrams = [diagram for diagram, keep in zip(diagrams, is_connected)
+                    if keep]
 
-    if commands.theory == "MBPT":
-        for i_diag, diag in reversed_enumerate(diags):
-            if (nx.number_weakly_connected_components(diag)) != 1:
-                del diags[i_diag]
+    diags = [adg.diag.graph_from_matrix(diagram) for diagram in diagrams]
 
     adg.diag.label_vertices(diags,
                             commands.theory,
@@ -321,6 +316,7 @@ def generate_diagrams(commands, id_generator):
                     for graph in diags]
 
     if commands.theory == "PBMBPT":
+        pbmbpt_diagrams = []
         for idx, diagram in reversed_enumerate(diagrams):
             new_graphs = adg.pbmbpt.generate_anomalous_diags(
                 diagram,
@@ -331,9 +327,9 @@ def generate_diagrams(commands, id_generator):
                                                           idx,
                                                           spawn_idx)
                          for spawn_idx, diag in enumerate(new_graphs)]
-            del diagrams[idx]
-            adg.pbmbpt.filter_new_diagrams(new_diags, diagrams)
-            diagrams += new_diags
+            adg.pbmbpt.filter_new_diagrams(new_diags, pbmbpt_diagrams)
+            pbmbpt_diagrams += new_diags
+        diagrams = pbmbpt_diagrams
     return diagrams
 
 
@@ -433,7 +429,7 @@ def prepare_drawing_instructions(directory, commands, diagrams, diagrams_time):
 
 
 def create_feynmanmp_files(diagrams, theory, directory, diag_type):
-    """Create and move the appropriate feynmanmp files to the right place.
+    """Create the appropriate feynmanmp files in the right place.
 
     Args:
         diagrams (list): The studied diagrams.
@@ -449,9 +445,8 @@ def create_feynmanmp_files(diagrams, theory, directory, diag_type):
             diag_name = '%s_%i' % (diag_type, diag.tags[0])
         adg.diag.feynmf_generator(diag.graph,
                                   'MBPT' if diag_type == 'time' else theory,
-                                  diag_name)
-        shutil.move('%s.tex' % diag_name,
-                    "%s/Diagrams/%s.tex" % (directory, diag_name))
+                                  diag_name,
+                                  "%s/Diagrams" % directory)
 
 
 def write_file_header(latex_file, commands, diags_nbs):
@@ -510,11 +505,14 @@ def compile_manager(directory):
         directory (str): Path to the ouput folder.
 
     """
-    os.chdir(directory)
-    os.system("pdflatex -shell-escape -interaction=batchmode result.tex")
-    # Second compilation for table of contents and diagrams
-    os.system("pdflatex -shell-escape -interaction=batchmode result.tex")
-    os.chdir("../..")
+    pdflatex_command = ["pdflatex", "-shell-escape", "-interaction=batchmode",
+                        "result.tex"]
+    try:
+        subprocess.call(pdflatex_command, cwd=directory)
+        # Second compilation for table of contents and diagrams
+        subprocess.call(pdflatex_command, cwd=directory)
+    except OSError:
+        print("pdflatex could not be run, the result file was not compiled.")
 
 
 def clean_folders(directory, commands):
@@ -4,7 +4,12 @@ import os
 import pytest
 import networkx as nx
 import numpy as np
+import adg.bimsrg
+import adg.bmbpt
 import adg.diag
+import adg.mbpt
+import adg.pbmbpt
+import adg.tsd
 
 
 def test_feynmf_generator():
@@ -178,3 +183,13 @@ def test_to_skeleton():
     # Test for an empty graph
     graph = nx.MultiDiGraph()
     assert list(adg.diag.to_skeleton(graph).edges()) == []
+
+
+def test_diagram_slots():
+    """Test that diagram instances do not carry a per-instance dict."""
+    for diagram_class in (adg.diag.Diagram, adg.mbpt.MbptDiagram,
+                          adg.bmbpt.BmbptFeynmanDiagram,
+                          adg.pbmbpt.ProjectedBmbptDiagram,
+                          adg.tsd.TimeStructureDiagram,
+                          adg.bimsrg.BimsrgDiagram):
+        assert '__dict__' not in dir(diagram_class)
@@ -1,7 +1,5 @@
 """Miscellaneous diagram-unrelated tools for ADG."""
 
-
-from builtins import object, zip
 from itertools import count
 
 
@@ -22,7 +20,7 @@ def reversed_enumerate(data):
         yield index, item
 
 
-class UniqueID(object):
+class UniqueID:
     """Counter making sure of generating a unique ID number for diagrams.
 
     Attributes:
@@ -1,6 +1,5 @@
 """Module with functions relative to time-stucture diagrams, called by ADG."""
 
-from builtins import range
 from adg.tools import reversed_enumerate
 import copy
 import os
@@ -73,17 +72,20 @@ def equivalent_labelled_tsds(equivalent_trees, labelled_tsds):
 
     """
     op_nm = nx.algorithms.isomorphism.categorical_node_match('operator', False)
+    # Only tree TSDs with the same degrees can be equivalent
+    tree_tsds = {}
+    for tdiag in labelled_tsds:
+        if tdiag.is_tree:
+            tree_tsds.setdefault(tdiag.io_degrees, []).append(tdiag)
     eq_labelled_tsds = ""
     for eq_tree_graph in equivalent_trees:
-        for comp_tdiag in labelled_tsds:
-            if tuple(sorted(tuple((eq_tree_graph.in_degree(node),
+        io_degrees = tuple(sorted((eq_tree_graph.in_degree(node),
                                    eq_tree_graph.out_degree(node))
-                                  for node in eq_tree_graph))) \
-                    == comp_tdiag.io_degrees \
-                    and comp_tdiag.is_tree:
-                if nx.is_isomorphic(eq_tree_graph, comp_tdiag.graph, op_nm):
-                    eq_labelled_tsds += " T%s," % (comp_tdiag.tags[0]+1)
-                    break
+                                  for node in eq_tree_graph))
+        for comp_tdiag in tree_tsds.get(io_degrees, []):
+            if nx.is_isomorphic(eq_tree_graph, comp_tdiag.graph, op_nm):
+                eq_labelled_tsds += " T%s," % (comp_tdiag.tags[0]+1)
+                break
     return "".join("%s." % eq_labelled_tsds.strip(','))
 
 
@@ -199,11 +201,8 @@ def treat_tsds(diagrams_time):
         (tuple): List of TSDs, number of tree TSDs
 
     """
-    tree_tsds = []
-    for i_diag, diag in reversed_enumerate(diagrams_time):
-        if diag.is_tree:
-            tree_tsds.append(diag)
-            del diagrams_time[i_diag]
+    tree_tsds = [diag for diag in reversed(diagrams_time) if diag.is_tree]
+    diagrams_time = [diag for diag in diagrams_time if not diag.is_tree]
 
     adg.diag.topologically_distinct_diagrams(tree_tsds)
     adg.diag.topologically_distinct_diagrams(diagrams_time)
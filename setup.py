@@ -6,8 +6,6 @@ You can install the program either by running
 or
     python setup.py install
 """
-from __future__ import print_function
-
 
 import sys
 from setuptools import setup
@@ -40,13 +38,12 @@ setup(
     license=adg.__license__,
     url='https://github.com/adgproject/adg',
     install_requires=[
-        "future",
         "more-itertools",
         "networkx>=2.0",
         "numpy",
         "scipy",
     ],
-    python_requires='>=2.7.1',
+    python_requires='>=3.8',
     extras_require=dict(
         # List additional groups of dependencies here (e.g. development
         # dependencies). You can install these using the following syntax:
@@ -68,10 +65,8 @@ setup(
         'Operating System :: MacOS',
         'Operating System :: POSIX',
         'Operating System :: Unix',
-        'Programming Language :: Python :: 2.7',
-        'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 3.6',
-        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3',
+        'Programming Language :: Python :: 3 :: Only',
         'Programming Language :: Python :: 3.8',
         'Programming Language :: Python :: 3.9',
         'Topic :: Scientific/Engineering',